@@ -60,5 +60,6 @@ setup(
     extras_require={
         'test': ['WebOb', 'jmespath'],
         'json': ['jmespath'],
+        'http2': ['httpx[http2]'],
     },
 )
@@ -24,9 +24,26 @@ __classifiers__ = [
 ]
 __all__ = ('URL',)
 
+import argparse
+import array
+import collections
 import collections.abc
+import concurrent.futures
+import contextlib
+import email.utils
 import functools
+import hashlib
+import io
+import ipaddress
+import itertools
+import json
+import os
+import queue
+import random
 import re
+import sys
+import threading
+import time
 import urllib.parse
 from pathlib import _PosixFlavour, PurePath
 
@@ -35,6 +52,7 @@ try:
 except ImportError:
     from mock import patch
 import requests
+import urllib3
 
 try:
     import jmespath
@@ -46,8 +64,22 @@ try:
 except ImportError:
     webob = None
 
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
 missing = object()
 
+# https://tools.ietf.org/html/rfc3986#section-6.2.3
+default_ports = {
+    'ftp': 21,
+    'http': 80,
+    'https': 443,
+    'ws': 80,
+    'wss': 443,
+}
+
 
 # http://stackoverflow.com/a/2704866/3622941
 class FrozenDict(collections.abc.Mapping):
@@ -120,6 +152,91 @@ def cached_property(getter):
     return helper
 
 
+_ascii_re = re.compile('[\\x00-\\x7f]*\\Z')
+
+
+@functools.lru_cache(maxsize=4096)
+def idna_encode(hostname):
+    """Cached version of `hostname.encode('idna').decode('ascii')`.
+
+    Plain ASCII hostname is returned as is without the `idna` codec. Host cardinality is far smaller than url
+    cardinality, so the result is shared by all instances.
+
+    :param str hostname: hostname string
+    :return: ASCII hostname string
+    :rtype: str
+    """
+    if _ascii_re.match(hostname):
+        labels = hostname.split('.')
+        if labels[-1] == '':
+            # trailing dot is allowed
+            del labels[-1]
+        # the codec does nothing but this validation for ASCII labels
+        if all(0 < len(label) < 64 for label in labels):
+            return hostname
+
+    return hostname.encode('idna').decode('ascii')
+
+
+@functools.lru_cache(maxsize=4096)
+def idna_decode(hostname):
+    """Cached version of `hostname.encode('ascii').decode('idna')`.
+
+    Hostname without ACE prefix ("xn--") is returned as is without the `idna` codec. Non-ASCII hostname is also
+    returned as is.
+
+    :param str hostname: hostname string
+    :return: Unicode hostname string
+    :rtype: str
+    """
+    if 'xn--' not in hostname.lower():
+        return hostname
+
+    try:
+        return hostname.encode('ascii').decode('idna')
+    except UnicodeEncodeError:
+        return hostname
+
+
+# https://tools.ietf.org/html/rfc3986#appendix-A
+safe_pchars = '-._~!$&\'()*+,;=:@'
+_plain_segment_re = re.compile('[A-Za-z0-9%s]*\\Z' % (re.escape(safe_pchars),))
+
+
+@functools.lru_cache(maxsize=4096)
+def segment_forms(segment):
+    """Return percent-encoded and decoded forms of a path segment, `(quoted, unquoted)`.
+
+    Segments like "api" or "v2" appear in most urls, so the result is shared by all instances. Segment that has
+    nothing to escape is returned as is without `urllib.parse.quote` and `urllib.parse.unquote`.
+
+    :param str segment: path segment string
+    :return: tuple of quoted string and unquoted string
+    :rtype: tuple
+    """
+    if _plain_segment_re.match(segment):
+        return segment, segment
+
+    return urllib.parse.quote(segment, safe=safe_pchars), urllib.parse.unquote(segment)
+
+
+_plain_name_re = re.compile('[^\\x00-\\x20:?#]+\\Z')
+_line_re = re.compile(b'[^\\r\\n]+')
+
+
+def decode_url(data):
+    """Decode url in bytes-like object, ASCII is tried first as it's much faster.
+
+    :param data: bytes-like object
+    :return: url string
+    :rtype: str
+    """
+    try:
+        return str(data, 'ascii')
+    except UnicodeDecodeError:
+        return str(data, 'utf-8')
+
+
 def netlocjoin(username, password, hostname, port):
     """Helper function for building netloc string.
 
@@ -142,7 +259,7 @@ def netlocjoin(username, password, hostname, port):
         result += '@'
 
     if hostname is not None:
-        result += hostname.encode('idna').decode('ascii')
+        result += idna_encode(hostname)
 
     if port is not None:
         result += ':' + str(port)
@@ -171,10 +288,129 @@ class _URLFlavour(_PosixFlavour):
         return drive, root, path
 
 
+class _URLParents(collections.abc.Sequence):
+    """Sequence of logical ancestors of url, which are built by `URL.parent` on demand."""
+    __slots__ = ('_url', '_parents')
+
+    def __init__(self, url):
+        self._url = url
+        self._parents = []
+
+    def __len__(self):
+        url = self._url
+        return len(url._parts) - 1 if url._drv or url._root else len(url._parts)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return tuple(self[i] for i in range(*idx.indices(len(self))))
+
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError(idx)
+
+        parents = self._parents
+        while len(parents) <= idx:
+            parents.append((parents[-1] if parents else self._url).parent)
+
+        return parents[idx]
+
+    def __repr__(self):
+        return '<{}.parents>'.format(self._url.__class__.__name__)
+
+
 class URL(urllib.parse._NetlocResultMixinStr, PurePath):
     _flavour = _URLFlavour()
     _parse_qsl_args = {}
     _urlencode_args = {'doseq': True}
+    _http_cache = None
+    _http_scheduler = None
+    _http_transport = None
+    _drive_properties = ('scheme', 'netloc', '_userinfo', '_hostinfo', 'hostinfo', 'username', 'password', 'hostname')
+    # `webob.request.PATH_SAFE`
+    _environ_path_safe = '/~!$&\'()*+,;=:@'
+
+    @classmethod
+    def _from_parts(cls, args, **kwargs):
+        if len(args) == 1 and webob and isinstance(args[0], webob.Request):
+            return cls.from_environ(args[0].environ)
+
+        if len(args) == 1 and isinstance(args[0], (bytes, bytearray, memoryview)):
+            # keep original bytes for `__bytes__`
+            source_bytes = bytes(args[0])
+            source = decode_url(source_bytes)
+            self = super()._from_parts((source,), **kwargs)
+            self.__dict__['_source'] = source
+            self.__dict__['_source_bytes'] = source_bytes
+            return self
+
+        return super()._from_parts(args, **kwargs)
+
+    @classmethod
+    def iter_buffer(cls, buffer):
+        """Iterate urls in a bytes-like object (`bytes`, `bytearray`, `memoryview`, `mmap`, etc.), one url per line.
+
+        Lines are matched on the buffer itself, the buffer is not copied or decoded as a whole.
+
+        :param buffer: bytes-like object
+        :return: iterator of url objects
+        """
+        for match in _line_re.finditer(buffer):
+            line = match.group().strip()
+            if line:
+                yield cls(line)
+
+    @classmethod
+    def from_environ(cls, environ, application=False):
+        """Return a new url of WSGI request.
+
+        Components are taken from `environ` directly, without formatting and parsing a url string like
+        `URL(webob.Request(environ).url)`.
+
+        :param dict environ: WSGI environ
+        :param bool application: url of the application (without `PATH_INFO` and `QUERY_STRING`) if `True`
+        :return: url object
+        """
+        # same as `webob.Request.host_url`
+        scheme = environ['wsgi.url_scheme']
+        host = environ.get('HTTP_HOST')
+        if host is not None:
+            if ':' in host and host[-1] != ']':
+                host, port = host.rsplit(':', 1)
+            else:
+                port = None
+        else:
+            host = environ['SERVER_NAME']
+            port = environ.get('SERVER_PORT')
+        if (scheme, port) in (('http', '80'), ('https', '443')):
+            port = None
+        drv = urllib.parse.urlunsplit((scheme.lower(), host + ':' + port if port else host, '', '', ''))
+
+        # https://www.python.org/dev/peps/pep-3333/#unicode-issues
+        path = environ.get('SCRIPT_NAME', '')
+        query = ''
+        if not application:
+            path += environ.get('PATH_INFO', '')
+            query = environ.get('QUERY_STRING', '')
+        path = urllib.parse.quote(path.encode('latin-1'), safe=cls._environ_path_safe)
+
+        # same as `_URLFlavour.parse_parts`
+        body = path.lstrip(cls._flavour.sep)
+        root = path[:len(path) - len(body)]
+        if body:
+            rel = body.rstrip(cls._flavour.sep)
+            segments = rel.split(cls._flavour.sep)
+            segments[-1] += body[len(rel):]
+        else:
+            segments = ['']
+        if query:
+            segments[-1] += '?' + query
+        parts = [i for i in segments if i and i != '.']
+
+        if drv or root:
+            parts.insert(0, drv + root)
+
+        return cls._from_parsed_parts(drv, root, parts)
 
     @classmethod
     def _parse_args(cls, args):
@@ -188,6 +424,9 @@ class URL(urllib.parse._NetlocResultMixinStr, PurePath):
         if isinstance(a, urllib.parse.ParseResult):
             return urllib.parse.urlunparse(a)
 
+        if isinstance(a, (bytes, bytearray, memoryview)):
+            return decode_url(a)
+
         if webob and isinstance(a, webob.Request):
             return a.url
 
@@ -199,9 +438,49 @@ class URL(urllib.parse._NetlocResultMixinStr, PurePath):
             self._parts[-1] = self._parts[-1].replace('\\x00', '/')
 
     def _make_child(self, args):
+        drv, root, parts = self._parse_args(args)
         # replace by parts that have no query and have no fragment
-        with patch.object(self, '_parts', list(self.parts)):
-            return super()._make_child(args)
+        drv, root, parts = self._flavour.join_parsed_parts(self._drv, self._root, list(self.parts), drv, root, parts)
+        result = self._from_parsed_parts(drv, root, parts)
+
+        if result._drv == self._drv:
+            result._share_drive(self)
+
+        return result
+
+    def _share_drive(self, other):
+        # copy cached properties that depend only on the drive, `other` must have the same drive.
+        for name in self._drive_properties:
+            key = '_cached_property_' + name
+            if key in other.__dict__:
+                self.__dict__[key] = other.__dict__[key]
+
+    @property
+    @cached_property
+    def parent(self):
+        """The logical parent of the url."""
+        drv, root, parts = self._drv, self._root, self._parts
+
+        if len(parts) == 1 and (drv or root):
+            return self
+
+        result = self._from_parsed_parts(drv, root, parts[:-1])
+
+        if result._drv == drv and result._parts == parts[:-1]:
+            # not reset by `_init` (e.g. `JailedURL`)
+            result._share_drive(self)
+
+            if '_cached_property_parts' in self.__dict__ and len(parts) > (2 if drv or root else 1) \
+                    and _plain_name_re.match(parts[-2]):
+                # `name` of parent is same as the part of self, if `urllib.parse.urlsplit` keeps it as path.
+                result.__dict__['_cached_property_parts'] = self.__dict__['_cached_property_parts'][:-1]
+
+        return result
+
+    @property
+    def parents(self):
+        """A sequence of this url's logical ancestors."""
+        return _URLParents(self)
 
     @cached_property
     def __str__(self):
@@ -210,6 +489,9 @@ class URL(urllib.parse._NetlocResultMixinStr, PurePath):
 
     @cached_property
     def __bytes__(self):
+        source_bytes = self.__dict__.get('_source_bytes')
+        if source_bytes is not None and str(self) == self.__dict__['_source']:
+            return source_bytes
         return str(self).encode('utf-8')
 
     # TODO: sort self.query in __hash__
@@ -225,9 +507,9 @@ class URL(urllib.parse._NetlocResultMixinStr, PurePath):
         """An object providing sequence-like access to the
         components in the filesystem path."""
         if self._drv or self._root:
-            return tuple([self._parts[0]] + [urllib.parse.unquote(i) for i in self._parts[1:-1]] + [self.name])
+            return tuple([self._parts[0]] + [segment_forms(i)[1] for i in self._parts[1:-1]] + [self.name])
         else:
-            return tuple([urllib.parse.unquote(i) for i in self._parts[:-1]] + [self.name])
+            return tuple([segment_forms(i)[1] for i in self._parts[:-1]] + [self.name])
 
     @property
     @cached_property
@@ -291,32 +573,24 @@ class URL(urllib.parse._NetlocResultMixinStr, PurePath):
         """The hostname of url."""
         result = super().hostname
         if result is not None:
-            try:
-                result = result.encode('ascii').decode('idna')
-            except UnicodeEncodeError:
-                pass
+            result = idna_decode(result)
         return result
 
     @property
     @cached_property
     def path(self):
         """The path of url, it's with trailing sep."""
-
-        # https://tools.ietf.org/html/rfc3986#appendix-A
-        safe_pchars = '-._~!$&\'()*+,;=:@'
-
         begin = 1 if self._drv or self._root else 0
 
         return self._root \
-               + self._flavour.sep.join(
-            urllib.parse.quote(i, safe=safe_pchars) for i in self._parts[begin:-1] + [self.name]) \
+               + self._flavour.sep.join(segment_forms(i)[0] for i in self._parts[begin:-1] + [self.name]) \
                + self.trailing_sep
 
     @property
     @cached_property
     def name(self):
         """The final path component, if any."""
-        return urllib.parse.unquote(urllib.parse.urlsplit(super().name).path.rstrip(self._flavour.sep))
+        return segment_forms(urllib.parse.urlsplit(super().name).path.rstrip(self._flavour.sep))[1]
 
     @property
     @cached_property
@@ -349,6 +623,37 @@ class URL(urllib.parse._NetlocResultMixinStr, PurePath):
         return FrozenMultiDict({k: tuple(v)
                                 for k, v in urllib.parse.parse_qs(self.query, **self._parse_qsl_args).items()})
 
+    @cached_property
+    def surt(self):
+        """Return SURT (Sort-friendly URI Reordering Transform) key of url, like "com,example,www)/path?query".
+
+        Userinfo and fragment are dropped, default port is omitted, IP address is not reversed.
+        """
+        path = self.path or '/'
+        if self.query:
+            path += '?' + self.query
+
+        if self.hostname is None:
+            return urllib.parse.urlunsplit((self.scheme, self.netloc, path, '', ''))
+
+        return surt_host(self.hostname, self.port, self.scheme) + ')' + path
+
+    @property
+    @cached_property
+    def _host_key(self):
+        return host_key(self.hostname or '')
+
+    def shard(self, n):
+        """Return shard number of url in `range(n)`, urls of the same hostname go to the same shard.
+
+        Jump consistent hash is used, so only about `1/n` of hosts move when `n` is changed to `n + 1`.
+
+        :param int n: number of shards
+        :return: shard number
+        :rtype: int
+        """
+        return jump_hash(self._host_key, n)
+
     def with_name(self, name):
         """Return a new url with the file name changed."""
         return super().with_name(urllib.parse.quote(name, safe=''))
@@ -470,6 +775,12 @@ class URL(urllib.parse._NetlocResultMixinStr, PurePath):
             return self.with_components(query=new)
         return self.with_components()
 
+    def with_query_field(self, name, value):
+        """Return a new url with the query field replaced (or added)."""
+        fields = [i for i in self.form_fields if i[0] != name]
+        fields.append((name, value))
+        return self.with_components(query=fields)
+
     def with_fragment(self, fragment):
         """Return a new url with the fragment changed."""
         return self.with_components(fragment=fragment)
@@ -500,17 +811,33 @@ class URL(urllib.parse._NetlocResultMixinStr, PurePath):
     def jailed(self):
         return JailedURL(self, root=self)
 
-    def get(self, params=None, **kwargs):
+    def _request(self, method, url, **kwargs):
+        transport = self._http_transport
+        send = functools.partial(requests.request if transport is None else transport.request, method, url, **kwargs)
+
+        if self._http_scheduler is not None:
+            return self._http_scheduler.request(send, url)
+
+        return send()
+
+    def get(self, params=None, cache=missing, **kwargs):
         r"""Sends a GET request.
 
         :param params: (optional) Dictionary or bytes to be sent in the query string for the :class:`Request`.
+        :param cache: (optional) :class:`HTTPCache` object, default is `_http_cache`. `None` disables cache.
         :param \*\*kwargs: Optional arguments that ``request`` takes.
         :return: :class:`Response <Response>` object
         :rtype: requests.Response
         """
 
         url = str(self)
-        response = requests.get(url, params, **kwargs)
+
+        if cache is missing:
+            cache = self._http_cache
+        if cache is not None:
+            return cache.request(functools.partial(self._request, 'GET'), url, params, **kwargs)
+
+        response = self._request('GET', url, params=params, **kwargs)
         return response
 
     def options(self, **kwargs):
@@ -522,7 +849,7 @@ class URL(urllib.parse._NetlocResultMixinStr, PurePath):
         """
 
         url = str(self)
-        return requests.options(url, **kwargs)
+        return self._request('OPTIONS', url, **kwargs)
 
     def head(self, **kwargs):
         r"""Sends a HEAD request.
@@ -533,7 +860,8 @@ class URL(urllib.parse._NetlocResultMixinStr, PurePath):
         """
 
         url = str(self)
-        return requests.options(url, **kwargs)
+        kwargs.setdefault('allow_redirects', False)
+        return self._request('HEAD', url, **kwargs)
 
     def post(self, data=None, json=None, **kwargs):
         r"""Sends a POST request.
@@ -546,7 +874,7 @@ class URL(urllib.parse._NetlocResultMixinStr, PurePath):
         """
 
         url = str(self)
-        return requests.post(url, data=data, json=json, **kwargs)
+        return self._request('POST', url, data=data, json=json, **kwargs)
 
     def put(self, data=None, **kwargs):
         r"""Sends a PUT request.
@@ -558,7 +886,7 @@ class URL(urllib.parse._NetlocResultMixinStr, PurePath):
         """
 
         url = str(self)
-        return requests.put(url, data=data, **kwargs)
+        return self._request('PUT', url, data=data, **kwargs)
 
     def patch(self, data=None, **kwargs):
         r"""Sends a PATCH request.
@@ -570,7 +898,7 @@ class URL(urllib.parse._NetlocResultMixinStr, PurePath):
         """
 
         url = str(self)
-        return requests.patch(url, data=data, **kwargs)
+        return self._request('PATCH', url, data=data, **kwargs)
 
     def delete(self, **kwargs):
         r"""Sends a DELETE request.
@@ -581,31 +909,210 @@ class URL(urllib.parse._NetlocResultMixinStr, PurePath):
         """
 
         url = str(self)
-        return requests.delete(url, **kwargs)
+        return self._request('DELETE', url, **kwargs)
+
+    def download(self, dest, chunk_size=64 * 1024, resume=True, parts=1, progress=None, **kwargs):
+        r"""Download to a file by streaming, without buffering whole content in memory.
+
+        :param dest: file name
+        :param int chunk_size: size of the reusable read buffer
+        :param bool resume: continue an interrupted download by a `Range` request. `dest + '.validator'` marks an
+            interrupted download and keeps the validator (ETag or Last-Modified) sent as `If-Range`, it's removed on
+            completion. Existing `dest` without it is downloaded again.
+        :param int parts: number of parallel range requests for a new file, used only if the server accepts ranges
+        :param progress: (optional) callable called as `progress(done_bytes, total_bytes_or_None, bytes_per_second)`
+        :param \*\*kwargs: Optional arguments that ``request`` takes.
+        :return: size of the file
+        :rtype: int
+        """
 
-    def get_text(self, name='', query='', pattern='', overwrite=False):
+        url = str(self)
+        request_headers = kwargs.pop('headers', None)
+        headers = dict(request_headers or {})
+        # content is written as is, and `Range` means ranges of encoded content.
+        headers['Accept-Encoding'] = 'identity'
+        validator_file = dest + '.validator'
+        offset = 0
+        validator = ''
+
+        if resume and os.path.exists(dest):
+            try:
+                with open(validator_file) as fp:
+                    validator = fp.read()
+            except OSError:
+                pass
+            else:
+                offset = os.path.getsize(dest)
+
+        if parts > 1 and not offset:
+            response = self._request('HEAD', url, headers=headers, allow_redirects=True, **kwargs)
+            length = int(response.headers.get('Content-Length') or 0)
+
+            if response.ok and response.headers.get('Accept-Ranges') == 'bytes' and length >= parts * chunk_size:
+                validator = _response_validator(response)
+                if validator:
+                    headers['If-Range'] = validator
+                result = self._download_parts(url, dest, length, chunk_size, parts, _Progress(progress, 0, length),
+                                              dict(kwargs, headers=headers))
+                with contextlib.suppress(OSError):
+                    os.remove(validator_file)
+                return result
+
+        if offset:
+            headers['Range'] = 'bytes=%d-' % (offset,)
+            if validator:
+                headers['If-Range'] = validator
+
+        response = self._request('GET', url, headers=headers, stream=True, **kwargs)
+
+        with contextlib.closing(response):
+            if offset and response.status_code == 416 \
+                    and response.headers.get('Content-Range') == 'bytes */%d' % (offset,):
+                # already completed
+                with contextlib.suppress(OSError):
+                    os.remove(validator_file)
+                return offset
+
+            response.raise_for_status()
+
+            if response.status_code == 206:
+                if not response.headers.get('Content-Range', '').startswith('bytes %d-' % (offset,)):
+                    # not the requested range, start over
+                    response.close()
+                    return self.download(dest, chunk_size, False, parts, progress, headers=request_headers, **kwargs)
+            else:
+                # server ignored `Range`, or the resource is changed and `If-Range` does not match
+                offset = 0
+
+            # mark as interrupted until completion, an empty validator means the server has no validator
+            with open(validator_file, 'w') as fp:
+                fp.write(_response_validator(response) or '')
+
+            length = response.headers.get('Content-Length')
+            meter = _Progress(progress, offset, offset + int(length) if length else None)
+
+            with open(dest, 'ab' if offset else 'wb') as fp:
+                result = offset + _copy_stream(response.raw, fp, chunk_size, meter)
+
+            os.remove(validator_file)
+            return result
+
+    def _download_parts(self, url, dest, length, chunk_size, parts, meter, kwargs):
+        # NOTE: Parts are written to a temporary file, `dest` never has holes so its size is a valid resume offset.
+        temp = dest + '.part'
+        with open(temp, 'wb') as fp:
+            fp.truncate(length)
+
+        def fetch(begin, end):
+            headers = dict(kwargs.get('headers') or {}, Range='bytes=%d-%d' % (begin, end - 1))
+            response = self._request('GET', url, **dict(kwargs, headers=headers, stream=True))
+
+            with contextlib.closing(response):
+                response.raise_for_status()
+                if response.status_code != 206:
+                    raise requests.HTTPError('Range request is not satisfied: %s' % (url,), response=response)
+
+                with open(temp, 'r+b') as fp:
+                    fp.seek(begin)
+                    _copy_stream(response.raw, fp, chunk_size, meter)
+
+        size = -(-length // parts)
+        try:
+            with concurrent.futures.ThreadPoolExecutor(parts) as executor:
+                for future in [executor.submit(fetch, begin, min(begin + size, length))
+                               for begin in range(0, length, size)]:
+                    future.result()
+        except BaseException:
+            os.remove(temp)
+            raise
+
+        os.replace(temp, dest)
+        return length
+
+    def paginate(self, items=None, next_key=None, page_param=None, cursor_param=None, start=1, prefetch=1,
+                 max_pages=None, **kwargs):
+        r"""Returns a lazy iterator over items across pages of a JSON api.
+
+        Pages are fetched by `get` in a background thread while the current page is being consumed. The next page is
+        found by:
+
+        * `cursor_param`: the value of `next_key` is set to the query field `cursor_param`
+        * `page_param`: the query field `page_param` is counted up from `start` until a page has no item
+        * `next_key`: the value of `next_key` is the (relative) url of the next page
+        * otherwise, `Link: <url>; rel="next"` header
+
+        :param items: (optional) jmespath expression or callable that returns items from the json, default is the json
+        :param next_key: (optional) jmespath expression or callable that returns the next url or cursor from the json
+        :param str page_param: (optional) query field name of the page number
+        :param str cursor_param: (optional) query field name of the cursor
+        :param int start: the first page number
+        :param int prefetch: max number of pages fetched ahead
+        :param int max_pages: (optional) max number of pages
+        :param \*\*kwargs: Optional arguments that ``get`` takes.
+        :return: iterator of items
+        """
+
+        if cursor_param and next_key is None:
+            raise ValueError('cursor_param requires next_key')
+        if isinstance(items, str) or isinstance(next_key, str):
+            if not jmespath:
+                raise ImportError('jmespath is not installed')
+        if isinstance(items, str):
+            items = jmespath.compile(items).search
+        if isinstance(next_key, str):
+            next_key = jmespath.compile(next_key).search
+
+        def pages():
+            url = self.with_query_field(page_param, start) if page_param else self
+            count = 0
+
+            while url is not None and (max_pages is None or count < max_pages):
+                response = url.get(**kwargs)
+                response.raise_for_status()
+                data = response.json()
+                page = items(data) if items else data
+                count += 1
+
+                yield page or ()
+
+                if cursor_param:
+                    cursor = next_key(data)
+                    url = self.with_query_field(cursor_param, cursor) if cursor else None
+                elif page_param:
+                    url = self.with_query_field(page_param, start + count) if page else None
+                elif next_key:
+                    link = next_key(data)
+                    url = self.__class__(urllib.parse.urljoin(str(url), str(link))) if link else None
+                else:
+                    link = response.links.get('next')
+                    url = self.__class__(urllib.parse.urljoin(str(url), link['url'])) if link else None
+
+        for page in _prefetch(pages(), prefetch):
+            yield from page
+
+    def get_text(self, name='', query='', pattern='', overwrite=False, cache=missing):
         """Runs a url with a specific query, amending query if necessary, and returns the resulting text"""
         q = query if overwrite else self.add_query(query).query if query else self.query
         url = self.joinpath(name) if name else self
-        res = url.with_query(q).get()
+        res = url.with_query(q).get(cache=cache)
 
         if res:
             if pattern:
                 if isinstance(pattern, str):  # patterns should be a compiled transformer like a regex object
                     pattern = re.compile(pattern)
 
-                return list(filter(pattern.match, res.text.split('\n')))
+                return list(filter(pattern.match, _response_text(res).split('\n')))
 
-            return res.text
+            return _response_text(res)
 
         return res
 
-    def get_json(self, name='', query='', keys='', overwrite=False):
+    def get_json(self, name='', query='', keys='', overwrite=False, cache=missing):
         """Runs a url with a specific query, amending query if necessary, and returns the result after applying a
         transformer"""
         q = query if overwrite else self.add_query(query).query if query else self.query
         url = self.joinpath(name) if name else self
-        res = url.with_query(q).get()
+        res = url.with_query(q).get(cache=cache)
 
         if res and keys:
             if not jmespath:
@@ -628,7 +1135,7 @@ class JailedURL(URL):
         elif cls._chroot is not None:
             root = cls._chroot
         elif webob and len(args) >= 1 and isinstance(args[0], webob.Request):
-            root = URL(args[0].application_url)
+            root = URL.from_environ(args[0].environ, application=True)
         else:
             root = URL(*args)
 
@@ -673,3 +1180,1482 @@ class JailedURL(URL):
     @property
     def chroot(self):
         return self._chroot
+
+
+class LazyURL(URL):
+    """URL that keeps the original string and parses it on demand.
+
+    `scheme`, netloc related properties, `query` and `fragment` are taken from `urllib.parse.urlsplit` without path
+    parsing, other properties and methods parse the whole url at first access. `str()` returns the original string
+    as is (not canonicalized), and `bytes()` returns the original bytes if given.
+
+    >>> url = LazyURL('HTTP://Example.com/a/./b')
+    >>> url.hostname
+    'example.com'
+    >>> str(url)
+    'HTTP://Example.com/a/./b'
+    >>> url.path
+    '/a/b'
+    """
+
+    @classmethod
+    def _from_parts(cls, args, **kwargs):
+        if len(args) == 1 and isinstance(args[0], str):
+            self = object.__new__(cls)
+            self.__dict__['_source'] = str(args[0])
+            return self
+
+        if len(args) == 1 and isinstance(args[0], (bytes, bytearray, memoryview)):
+            self = object.__new__(cls)
+            self.__dict__['_source_bytes'] = bytes(args[0])
+            self.__dict__['_source'] = decode_url(self.__dict__['_source_bytes'])
+            return self
+
+        return super()._from_parts(args, **kwargs)
+
+    def __getattr__(self, name):
+        # `PurePath` slots are not set until parsed.
+        if name in ('_drv', '_root', '_parts') and '_source' in self.__dict__:
+            self._drv, self._root, self._parts = self._parse_args((self.__dict__['_source'],))
+            self._init()
+            return getattr(self, name)
+
+        raise AttributeError('{!r} object has no attribute {!r}'.format(self.__class__.__name__, name))
+
+    def __reduce__(self):
+        return self.__class__, (str(self),)
+
+    def __str__(self):
+        try:
+            return self.__dict__['_source']
+        except KeyError:
+            return super().__str__()
+
+    @property
+    @cached_property
+    def _split(self):
+        # `None` if derived from other url (already parsed)
+        source = self.__dict__.get('_source')
+        return None if source is None else urllib.parse.urlsplit(source)
+
+    @property
+    @cached_property
+    def scheme(self):
+        """The scheme of url."""
+        return super().scheme if self._split is None else self._split.scheme
+
+    @property
+    @cached_property
+    def _userinfo(self):
+        return super()._userinfo if self._split is None else self._split._userinfo
+
+    @property
+    @cached_property
+    def _hostinfo(self):
+        return super()._hostinfo if self._split is None else self._split._hostinfo
+
+    @property
+    @cached_property
+    def query(self):
+        """The query of url."""
+        return super().query if self._split is None else self._split.query
+
+    @property
+    @cached_property
+    def fragment(self):
+        """The fragment of url."""
+        return super().fragment if self._split is None else self._split.fragment
+
+
+CacheInfo = collections.namedtuple('CacheInfo', ('hits', 'revalidations', 'misses', 'maxsize', 'currsize'))
+
+
+def parse_cache_control(value):
+    """Parse Cache-Control header value.
+
+    :param str value: header value
+    :return: directives, value is `None` if the directive has no argument
+    :rtype: dict
+    """
+    result = {}
+
+    for directive in value.split(','):
+        name, sep, argument = directive.partition('=')
+        name = name.strip().lower()
+        if name:
+            result[name] = argument.strip().strip('"') if sep else None
+
+    return result
+
+
+def _response_text(response):
+    # `response.text` decodes content every time, memoize it on the response object stored in the cache. Text is
+    # immutable so it's shared by all copies, but json is parsed every time so callers can modify it.
+    stored = response.__dict__.get('_urlpath_stored', response)
+    try:
+        return stored.__dict__['_urlpath_text']
+    except KeyError:
+        result = stored.__dict__['_urlpath_text'] = response.text
+        return result
+
+
+def _copy_response(response, stored=True):
+    # Stored response is shared, callers get their own copy. Stored response is never modified after it's stored, so
+    # a copy of `stored=True` shares the decoded text with it.
+    result = requests.Response()
+    result.__dict__.update(response.__dict__)
+    result.headers = response.headers.copy()
+    result.cookies = response.cookies.copy()
+    result.history = list(response.history)
+    if stored:
+        result.__dict__['_urlpath_stored'] = response
+    else:
+        result.__dict__.pop('_urlpath_stored', None)
+    return result
+
+
+class _CacheEntry:
+    __slots__ = ('response', 'expires', 'vary', 'etag', 'last_modified')
+
+    def __init__(self, response, expires, vary=()):
+        self.response = response
+        self.expires = expires
+        # `(lowercase header name, request header value)` pairs of the headers listed in `Vary`
+        self.vary = vary
+        self.etag = response.headers.get('ETag')
+        self.last_modified = response.headers.get('Last-Modified')
+
+    def matches(self, headers):
+        return all(headers.get(name) == value for name, value in self.vary)
+
+    def dump(self, key, fp):
+        # NOTE: Entry is stored as a line of json metadata and raw content, never pickle that runs code on load.
+        response = self.response
+        fp.write(json.dumps({
+            'key': key,
+            'expires': self.expires,
+            'vary': self.vary,
+            'status_code': response.status_code,
+            'reason': response.reason,
+            'url': response.url,
+            'encoding': response.encoding,
+            'headers': list(response.headers.items()),
+        }).encode('utf-8') + b'\n')
+        fp.write(response.content)
+
+    @classmethod
+    def load(cls, fp):
+        """Return `(key, entry)` of stored entry."""
+        metadata = json.loads(fp.readline().decode('utf-8'))
+
+        response = requests.Response()
+        response.status_code = int(metadata['status_code'])
+        response.reason = metadata['reason']
+        response.url = metadata['url']
+        response.encoding = metadata['encoding']
+        response.headers = requests.structures.CaseInsensitiveDict(metadata['headers'])
+        response._content = fp.read()
+        response._content_consumed = True
+
+        return metadata['key'], cls(response, float(metadata['expires']), tuple(map(tuple, metadata['vary'])))
+
+
+class HTTPCache:
+    """Private HTTP cache for `URL.get`, `URL.get_text` and `URL.get_json`.
+
+    Responses are keyed by the canonical url and the credentials (`Authorization` and `Cookie` headers), and stored in
+    a memory LRU, and in `directory` if given. A stored response is used only if the request headers listed in its
+    `Vary` are the same, requests with `auth` or `cookies` arguments are not cached. `Cache-Control` (`no-store`,
+    `no-cache`, `max-age`) and `Expires` decide freshness, stale responses are revalidated by `If-None-Match` and
+    `If-Modified-Since`. On "304 Not Modified" the stored content is reused. Callers get a copy of the stored response,
+    the text decoded by `URL.get_text` is shared between copies.
+
+    Files in `directory` are served as responses, so it must be writable only by trusted users (a private directory,
+    not a shared one like "/tmp").
+
+    >>> cache = HTTPCache(maxsize=256, directory=os.path.expanduser('~/.cache/urlpath'))  # doctest: +SKIP
+    >>> URL('https://httpbin.org/cache/60').get_json(cache=cache)  # doctest: +SKIP
+    >>> cache.cache_info()  # doctest: +SKIP
+    CacheInfo(hits=0, revalidations=0, misses=1, maxsize=256, currsize=1)
+    """
+
+    # request headers that identify the requester, they are part of the key
+    _credential_headers = ('Authorization', 'Cookie')
+    # headers that must not be updated by "304 Not Modified" response
+    _excluded_headers = frozenset(('content-length', 'content-encoding', 'transfer-encoding'))
+
+    def __init__(self, maxsize=128, directory=None):
+        """
+        :param int maxsize: max number of responses in memory
+        :param str directory: (optional) directory to store responses, it must be writable only by trusted users
+        """
+        self.maxsize = maxsize
+        self.directory = directory
+        self._entries = collections.OrderedDict()
+        self._lock = threading.RLock()
+        self._hits = self._revalidations = self._misses = 0
+
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def cache_info(self):
+        """Report cache statistics."""
+        with self._lock:
+            return CacheInfo(self._hits, self._revalidations, self._misses, self.maxsize, len(self._entries))
+
+    def cache_clear(self):
+        """Clear the cache and cache statistics."""
+        with self._lock:
+            self._entries.clear()
+            self._hits = self._revalidations = self._misses = 0
+
+            if self.directory is not None:
+                for filename in os.listdir(self.directory):
+                    if filename.endswith('.cache'):
+                        os.remove(os.path.join(self.directory, filename))
+
+    @classmethod
+    def key(cls, url, params=None, headers=None):
+        """Return cache key of request, credentials in `headers` are included as a digest."""
+        if params:
+            url = requests.Request('GET', url, params=params).prepare().url
+
+        if headers:
+            headers = requests.structures.CaseInsensitiveDict(headers)
+            credentials = [headers.get(i) for i in cls._credential_headers]
+            if any(credentials):
+                url += ' ' + hashlib.sha256(repr(credentials).encode('utf-8')).hexdigest()
+
+        return url
+
+    def request(self, send, url, params=None, **kwargs):
+        r"""Sends a GET request via `send` unless a fresh response is stored.
+
+        :param send: callable that has `requests.get` signature
+        :param str url: url string
+        :param params: (optional) Dictionary or bytes to be sent in the query string for the :class:`Request`.
+        :param \*\*kwargs: Optional arguments that ``request`` takes.
+        :return: :class:`Response <Response>` object
+        :rtype: requests.Response
+        """
+        if kwargs.get('stream') or kwargs.get('auth') is not None or kwargs.get('cookies'):
+            # streamed content is not stored, and credentials in `auth` and `cookies` can't be keyed
+            return send(url, params=params, **kwargs)
+
+        request_headers = requests.structures.CaseInsensitiveDict(kwargs.pop('headers', None) or {})
+        key = self.key(url, params, request_headers)
+        entry = self._lookup(key)
+        if entry is not None and not entry.matches(request_headers):
+            entry = None
+        now = time.time()
+
+        if entry is not None and entry.expires > now:
+            with self._lock:
+                self._hits += 1
+            return _copy_response(entry.response)
+
+        headers = dict(request_headers)
+        if entry is not None:
+            if entry.etag:
+                headers['If-None-Match'] = entry.etag
+            if entry.last_modified:
+                headers['If-Modified-Since'] = entry.last_modified
+
+        response = send(url, params=params, headers=headers, **kwargs)
+
+        if entry is not None and response.status_code == 304:
+            stored = _copy_response(entry.response, stored=False)
+            for name, value in response.headers.items():
+                if name.lower() not in self._excluded_headers:
+                    stored.headers[name] = value
+            if stored.headers.get('Content-Type') != entry.response.headers.get('Content-Type'):
+                stored.encoding = requests.utils.get_encoding_from_headers(stored.headers)
+                stored.__dict__.pop('_urlpath_text', None)
+            entry = _CacheEntry(stored, self._expires(stored.headers, now), entry.vary)
+
+            with self._lock:
+                self._revalidations += 1
+            self._store(key, entry)
+
+            return _copy_response(entry.response)
+
+        with self._lock:
+            self._misses += 1
+
+        vary = [i.strip().lower() for i in response.headers.get('Vary', '').split(',') if i.strip()]
+        if response.status_code == 200 and '*' not in vary:
+            expires = self._expires(response.headers, now)
+            if expires is not None:
+                # the caller owns `response`, a private copy is stored
+                entry = _CacheEntry(_copy_response(response, stored=False), expires,
+                                    tuple((i, request_headers.get(i)) for i in vary))
+                if entry.expires > now or entry.etag or entry.last_modified:
+                    self._store(key, entry)
+
+        return response
+
+    @staticmethod
+    def _expires(headers, now):
+        # https://tools.ietf.org/html/rfc7234#section-4.2.1
+        directives = parse_cache_control(headers.get('Cache-Control', ''))
+
+        if 'no-store' in directives:
+            return None
+
+        if 'no-cache' in directives:
+            return now
+
+        if 'max-age' in directives:
+            try:
+                return now + int(directives['max-age']) - int(headers.get('Age', 0))
+            except ValueError:
+                return now
+
+        if 'Expires' in headers:
+            try:
+                expires = email.utils.parsedate_to_datetime(headers['Expires']).timestamp()
+                if 'Date' in headers:
+                    # correct clock skew between the server and here
+                    expires += now - email.utils.parsedate_to_datetime(headers['Date']).timestamp()
+                return expires
+            except (TypeError, ValueError):
+                return now
+
+        return now
+
+    def _filename(self, key):
+        return os.path.join(self.directory, hashlib.sha256(key.encode('utf-8')).hexdigest() + '.cache')
+
+    def _lookup(self, key):
+        with self._lock:
+            try:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+            except KeyError:
+                pass
+
+        if self.directory is None:
+            return None
+
+        try:
+            with open(self._filename(key), 'rb') as fp:
+                stored_key, entry = _CacheEntry.load(fp)
+        except (OSError, ValueError, TypeError, KeyError):
+            return None
+
+        if stored_key != key:
+            return None
+
+        self._store(key, entry, persist=False)
+        return entry
+
+    def _store(self, key, entry, persist=True):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+        if persist and self.directory is not None:
+            filename = self._filename(key)
+            with open(filename + '.tmp%d' % (threading.get_ident(),), 'wb') as fp:
+                entry.dump(key, fp)
+            os.replace(fp.name, filename)
+
+
+def parse_retry_after(value):
+    """Parse Retry-After header value.
+
+    :param str value: header value, delay seconds or HTTP-date
+    :return: delay seconds or `None` if malformed
+    :rtype: float
+    """
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class _HostState:
+    __slots__ = ('condition', 'rate', 'burst', 'tokens', 'updated', 'paused_until', 'active', 'max_concurrency',
+                 'concurrency')
+
+    def __init__(self, rate, burst, concurrency):
+        self.condition = threading.Condition()
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.active = 0
+        self.max_concurrency = concurrency
+        self.concurrency = float(concurrency)
+
+    def acquire(self):
+        with self.condition:
+            while True:
+                now = time.monotonic()
+
+                if self.rate is not None:
+                    self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+
+                if now < self.paused_until:
+                    timeout = self.paused_until - now
+                elif self.active >= int(self.concurrency):
+                    timeout = None  # wait for release
+                elif self.rate is None:
+                    self.active += 1
+                    return
+                elif self.tokens >= 1:
+                    self.tokens -= 1
+                    self.active += 1
+                    return
+                else:
+                    timeout = (1 - self.tokens) / self.rate
+
+                self.condition.wait(timeout)
+
+    def release(self, throttled):
+        with self.condition:
+            self.active -= 1
+
+            # AIMD, like TCP congestion control
+            if throttled:
+                self.concurrency = max(1.0, self.concurrency / 2)
+            elif throttled is not None:
+                self.concurrency = min(float(self.max_concurrency), self.concurrency + 1 / self.concurrency)
+
+            self.condition.notify_all()
+
+    def pause(self, delay):
+        with self.condition:
+            self.paused_until = max(self.paused_until, time.monotonic() + delay)
+
+
+class HostScheduler:
+    """Per-host rate limiter and retry scheduler for `URL` HTTP methods.
+
+    Requests to a host are paced by a token bucket (`rate` requests per second, `burst` at once) and the number of
+    concurrent requests is adapted by AIMD: it is halved on every throttled response (`retry_statuses`) and grows
+    slowly up to `concurrency` on success. Throttled requests are retried after `Retry-After` or jittered exponential
+    backoff, and other threads wait for the same host meanwhile. One instance is shared by all threads.
+
+    >>> class ThrottledURL(URL):
+    ...     _http_scheduler = HostScheduler(rate=10)
+    """
+
+    def __init__(self, rate=None, burst=1, concurrency=8, retries=5, backoff=0.5, max_backoff=60.0,
+                 retry_statuses=(429, 503)):
+        """
+        :param float rate: (optional) requests per second per host, `None` means unlimited
+        :param int burst: size of token bucket
+        :param int concurrency: max number of concurrent requests per host
+        :param int retries: max number of retries
+        :param float backoff: base seconds of exponential backoff
+        :param float max_backoff: max seconds of exponential backoff
+        :param retry_statuses: status codes that mean the host is overloaded
+        """
+        self.rate = rate
+        self.burst = burst
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.retry_statuses = frozenset(retry_statuses)
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def _host(self, host):
+        with self._lock:
+            try:
+                return self._hosts[host]
+            except KeyError:
+                result = self._hosts[host] = _HostState(self.rate, self.burst, self.concurrency)
+                return result
+
+    def request(self, send, url):
+        """Call `send` when the host of `url` is ready, and retry it while the host is overloaded.
+
+        :param send: callable that sends a request and returns `requests.Response`
+        :param str url: url string
+        :return: :class:`Response <Response>` object
+        :rtype: requests.Response
+        """
+        state = self._host(urllib.parse.urlsplit(url).netloc.lower())
+
+        for attempt in itertools.count():
+            state.acquire()
+            try:
+                response = send()
+            except BaseException:
+                state.release(None)
+                raise
+
+            throttled = response.status_code in self.retry_statuses
+            state.release(throttled)
+
+            if not throttled or attempt >= self.retries:
+                return response
+
+            delay = parse_retry_after(response.headers.get('Retry-After', ''))
+            if delay is None:
+                # "full jitter", https://aws.amazon.com/blogs/architecture/exponential-backoff-and-jitter/
+                delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+            response.close()
+            state.pause(delay)
+
+
+class _IteratorReader(io.RawIOBase):
+    """Readable file object over an iterable of bytes, used as `requests.Response.raw`."""
+
+    def __init__(self, iterable, close=None):
+        self._iterator = iter(iterable)
+        self._buffer = b''
+        self._close = close
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._buffer:
+            try:
+                self._buffer = memoryview(next(self._iterator))
+            except StopIteration:
+                self._release()
+                return 0
+
+        size = min(len(b), len(self._buffer))
+        b[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
+    def _release(self):
+        self._iterator = iter(())
+        if self._close is not None:
+            close, self._close = self._close, None
+            close()
+
+    def close(self):
+        self._release()
+        super().close()
+
+
+class Transport:
+    """Base class of HTTP backends for `URL` HTTP methods, set an instance to `URL._http_transport`.
+
+    `request` takes the same arguments as `requests.request` and returns `requests.Response`, so the backends are
+    interchangeable. Subclasses implement `send`, request is prepared by `requests` and redirects are followed here.
+    `verify`, `cert` and `proxies` are not accepted per request, they are options of the backend.
+
+    >>> class LocalURL(URL):
+    ...     _http_transport = LocalTransport(lambda environ, start_response: [])
+    """
+    max_redirects = 30
+    _send_options = ('timeout', 'stream')
+
+    def request(self, method, url, allow_redirects=True, **kwargs):
+        r"""Send a request.
+
+        :param str method: method for the request
+        :param str url: url string
+        :param bool allow_redirects: follow redirects
+        :param \*\*kwargs: Optional arguments that ``requests.request`` takes.
+        :return: :class:`Response <Response>` object
+        :rtype: requests.Response
+        """
+        options = {name: kwargs.pop(name) for name in self._send_options if name in kwargs}
+        prepared = requests.Request(method, url, **kwargs).prepare()
+        history = []
+
+        while True:
+            response = self.send(prepared, **options)
+            if not (allow_redirects and response.is_redirect):
+                break
+
+            if len(history) >= self.max_redirects:
+                response.close()
+                raise requests.TooManyRedirects('Exceeded {} redirects.'.format(self.max_redirects), response=response)
+
+            # release the connection
+            response.content
+            response.close()
+            history.append(response)
+            prepared = self._redirect(prepared, response)
+
+        response.history = history
+        return response
+
+    def send(self, prepared, timeout=None, stream=False):
+        """Send a prepared request once.
+
+        :param requests.PreparedRequest prepared: prepared request
+        :param timeout: (optional) seconds, or tuple of connect and read seconds
+        :param bool stream: `False` to load content before return
+        :return: :class:`Response <Response>` object
+        :rtype: requests.Response
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """Release connections of the backend."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @staticmethod
+    def _redirect(prepared, response):
+        url = urllib.parse.urljoin(response.url, response.headers['Location'])
+        prepared = prepared.copy()
+
+        # same as `requests.Session.rebuild_method`
+        if (response.status_code == 303 and prepared.method != 'HEAD') \
+                or (response.status_code in (301, 302) and prepared.method == 'POST'):
+            prepared.method = 'GET'
+            prepared.body = None
+            for name in ('Content-Length', 'Content-Type', 'Transfer-Encoding'):
+                prepared.headers.pop(name, None)
+
+        if urllib.parse.urlsplit(url).hostname != urllib.parse.urlsplit(prepared.url).hostname:
+            prepared.headers.pop('Authorization', None)
+
+        prepared.prepare_url(url, None)
+        return prepared
+
+    @staticmethod
+    def _response(prepared, status, reason, headers, raw, stream):
+        response = requests.Response()
+        response.status_code = status
+        response.reason = reason
+        response.headers = requests.structures.CaseInsensitiveDict(headers)
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+        response.url = prepared.url
+        response.request = prepared
+        response.raw = raw
+
+        if not stream:
+            response.content
+
+        return response
+
+
+class RequestsTransport(Transport):
+    """`requests.Session` backend, connections are kept alive between calls unlike the default `requests.request`."""
+
+    def __init__(self, session=None):
+        """
+        :param requests.Session session: (optional) session object
+        """
+        self.session = requests.Session() if session is None else session
+
+    def request(self, method, url, **kwargs):
+        return self.session.request(method, url, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+
+class Urllib3Transport(Transport):
+    """Pooled `urllib3` backend without the per-call overhead of `requests.Session`."""
+
+    def __init__(self, pool=None, **kwargs):
+        r"""
+        :param urllib3.PoolManager pool: (optional) pool manager object
+        :param \*\*kwargs: Optional arguments that ``urllib3.PoolManager`` takes, e.g. ``maxsize`` or ``ca_certs``.
+        """
+        self.pool = urllib3.PoolManager(**kwargs) if pool is None else pool
+
+    def send(self, prepared, timeout=None, stream=False):
+        if isinstance(timeout, tuple):
+            timeout = urllib3.Timeout(connect=timeout[0], read=timeout[1])
+        else:
+            timeout = urllib3.Timeout(connect=timeout, read=timeout)
+
+        try:
+            raw = self.pool.urlopen(prepared.method, prepared.url, body=prepared.body, headers=prepared.headers,
+                                    redirect=False, retries=False, preload_content=False, decode_content=False,
+                                    timeout=timeout)
+        except urllib3.exceptions.ConnectTimeoutError as e:
+            raise requests.ConnectTimeout(e, request=prepared)
+        except urllib3.exceptions.TimeoutError as e:
+            raise requests.ReadTimeout(e, request=prepared)
+        except urllib3.exceptions.SSLError as e:
+            raise requests.exceptions.SSLError(e, request=prepared)
+        except urllib3.exceptions.HTTPError as e:
+            raise requests.ConnectionError(e, request=prepared)
+
+        response = self._response(prepared, raw.status, raw.reason, raw.headers, raw, stream)
+        requests.cookies.extract_cookies_to_jar(response.cookies, prepared, raw)
+        return response
+
+    def close(self):
+        self.pool.clear()
+
+
+class HTTP2Transport(Transport):
+    """HTTP/2 backend by `httpx`, concurrent requests to a host from threads are multiplexed over one connection.
+
+    `httpx` with HTTP/2 support is required (`pip install httpx[http2]`).
+    """
+
+    def __init__(self, client=None, **kwargs):
+        r"""
+        :param httpx.Client client: (optional) client object
+        :param \*\*kwargs: Optional arguments that ``httpx.Client`` takes, ``http2=True`` and ``timeout=None`` by
+            default.
+        """
+        if httpx is None:
+            raise ImportError('httpx is required by {}'.format(self.__class__.__name__))
+
+        if client is None:
+            kwargs.setdefault('http2', True)
+            kwargs.setdefault('timeout', None)
+            client = httpx.Client(**kwargs)
+        self.client = client
+
+    def send(self, prepared, timeout=None, stream=False):
+        body = prepared.body
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+
+        options = {}
+        if isinstance(timeout, tuple):
+            options['timeout'] = httpx.Timeout(None, connect=timeout[0], read=timeout[1])
+        elif timeout is not None:
+            options['timeout'] = httpx.Timeout(timeout)
+
+        try:
+            request = self.client.build_request(prepared.method, prepared.url, headers=dict(prepared.headers),
+                                                content=body, **options)
+            raw = self.client.send(request, stream=True, follow_redirects=False)
+        except httpx.ConnectTimeout as e:
+            raise requests.ConnectTimeout(e, request=prepared)
+        except httpx.TimeoutException as e:
+            raise requests.ReadTimeout(e, request=prepared)
+        except httpx.TransportError as e:
+            raise requests.ConnectionError(e, request=prepared)
+
+        # NOTE: `iter_bytes` is already decoded by Content-Encoding.
+        return self._response(prepared, raw.status_code, raw.reason_phrase, raw.headers.items(),
+                              _IteratorReader(raw.iter_bytes(), raw.close), stream)
+
+    def close(self):
+        self.client.close()
+
+
+class LocalTransport(Transport):
+    """In-process backend that calls a WSGI application directly, no socket is used. For tests and benchmarks."""
+
+    def __init__(self, app):
+        """
+        :param app: WSGI application
+        """
+        self.app = app
+
+    def send(self, prepared, timeout=None, stream=False):
+        split = urllib.parse.urlsplit(prepared.url)
+
+        body = prepared.body
+        if body is None:
+            body = b''
+        elif isinstance(body, str):
+            body = body.encode('utf-8')
+        elif hasattr(body, 'read'):
+            body = body.read()
+        elif not isinstance(body, (bytes, bytearray)):
+            body = b''.join(body)
+
+        environ = {
+            'REQUEST_METHOD': prepared.method,
+            'SCRIPT_NAME': '',
+            'PATH_INFO': urllib.parse.unquote_to_bytes(split.path or '/').decode('latin-1'),
+            'QUERY_STRING': split.query,
+            'SERVER_NAME': split.hostname or 'localhost',
+            'SERVER_PORT': str(split.port or default_ports.get(split.scheme, 80)),
+            'SERVER_PROTOCOL': 'HTTP/1.1',
+            'REMOTE_ADDR': '127.0.0.1',
+            'HTTP_HOST': split.netloc.rpartition('@')[2],
+            'CONTENT_LENGTH': str(len(body)),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': split.scheme,
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        for name, value in prepared.headers.items():
+            key = name.upper().replace('-', '_')
+            if key not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                key = 'HTTP_' + key
+            environ[key] = value
+
+        started = []
+        written = []
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and started:
+                raise exc_info[1].with_traceback(exc_info[2])
+            started[:] = [status, headers]
+            return written.append
+
+        result = self.app(environ, start_response)
+        iterator = iter(result)
+        # start_response may be called by the first iteration
+        first = []
+        while not started:
+            try:
+                first.append(next(iterator))
+            except StopIteration:
+                break
+        if not started:
+            raise RuntimeError('WSGI application did not call start_response')
+
+        status, header_list = started
+        headers = collections.OrderedDict()
+        for name, value in header_list:
+            key = name.lower()
+            headers[key] = (headers[key][0], headers[key][1] + ', ' + value) if key in headers else (name, value)
+
+        chunks = () if prepared.method == 'HEAD' else itertools.chain(written, first, iterator)
+        raw = _IteratorReader(chunks, getattr(result, 'close', None))
+        if prepared.method == 'HEAD':
+            raw.close()
+
+        code, _, reason = status.partition(' ')
+        return self._response(prepared, int(code), reason, headers.values(), raw, stream)
+
+
+def _response_validator(response):
+    """Return validator of response for `If-Range`, strong ETag or Last-Modified."""
+    etag = response.headers.get('ETag')
+    if etag and not etag.startswith('W/'):
+        return etag
+    return response.headers.get('Last-Modified')
+
+
+class _Progress:
+    __slots__ = ('callback', 'done', 'total', 'initial', 'started', 'lock')
+
+    def __init__(self, callback, done, total):
+        self.callback = callback
+        self.done = self.initial = done
+        self.total = total
+        self.started = time.monotonic()
+        self.lock = threading.Lock()
+
+    def update(self, size):
+        if self.callback is None:
+            return
+
+        with self.lock:
+            self.done += size
+            elapsed = time.monotonic() - self.started
+            self.callback(self.done, self.total, (self.done - self.initial) / elapsed if elapsed else 0.0)
+
+
+def _copy_stream(source, fp, chunk_size, meter):
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    result = 0
+
+    while True:
+        size = source.readinto(buffer)
+        if not size:
+            break
+
+        fp.write(view[:size])
+        result += size
+        meter.update(size)
+
+    return result
+
+
+def _prefetch(iterable, size):
+    """Iterate `iterable` in a background thread, at most `size` items are produced ahead of the consumer."""
+    items = queue.Queue()
+    slots = threading.Semaphore(max(1, size))
+    stop = threading.Event()
+    end = object()
+
+    def run():
+        try:
+            iterator = iter(iterable)
+            while True:
+                while not slots.acquire(timeout=0.1):
+                    if stop.is_set():
+                        return
+                if stop.is_set():
+                    return
+                item = next(iterator, end)
+                items.put((item, None))
+                if item is end:
+                    return
+        except BaseException as e:
+            items.put((end, e))
+
+    threading.Thread(target=run, daemon=True).start()
+
+    try:
+        while True:
+            item, error = items.get()
+            if error is not None:
+                raise error
+            if item is end:
+                return
+            slots.release()
+            yield item
+    finally:
+        stop.set()
+
+
+class URLStore(collections.abc.Sequence):
+    """Memory efficient sequence of urls, `URL` objects are made on access.
+
+    Urls are stored in array-backed columns:
+
+    * scheme and netloc are dictionary-encoded, hostname of each netloc is also dictionary-encoded
+    * path is front-coded (common prefix length with the previous path + suffix), restarted every `block_size` urls
+    * query and fragment are stored as `"?query#fragment"` in one buffer with offsets
+
+    Url objects are parsed from the stored url string, same as `url_class(str(url))`.
+
+    >>> store = URLStore(['http://example.com/a/b?q', 'http://example.com/a/c', 'https://example.org/'])
+    >>> store[1]
+    URL('http://example.com/a/c')
+    >>> [str(i) for i in store.filter(host='example.com', path_prefix='/a/', has_query=False)]
+    ['http://example.com/a/c']
+    """
+    block_size = 16
+
+    def __init__(self, urls=(), url_class=URL):
+        """
+        :param urls: iterable of url objects or strings
+        :param url_class: class of url objects made on access
+        """
+        self.url_class = url_class
+        self._schemes = []
+        self._scheme_ids = {}
+        self._netlocs = []
+        self._netloc_ids = {}
+        self._hosts = []
+        self._host_ids = {}
+        self._netloc_hosts = array.array('I')  # netloc id -> host id
+        self._scheme_column = array.array('I')
+        self._netloc_column = array.array('I')
+        self._prefix_lengths = array.array('I')
+        self._path_offsets = array.array('Q', (0,))
+        self._path_data = bytearray()
+        self._tail_offsets = array.array('Q', (0,))
+        self._tail_data = bytearray()
+        self._last_path = b''
+
+        self.extend(urls)
+
+    def __len__(self):
+        return len(self._scheme_column)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+
+        return self.url_class(self.get_str(idx))
+
+    def __iter__(self):
+        for i in self.strings():
+            yield self.url_class(i)
+
+    def __repr__(self):
+        return '<{} ({} urls)>'.format(self.__class__.__name__, len(self))
+
+    @property
+    def nbytes(self):
+        """Approximate size of columns in bytes."""
+        columns = (self._netloc_hosts, self._scheme_column, self._netloc_column, self._prefix_lengths,
+                   self._path_offsets, self._tail_offsets)
+        return sum(len(i) * i.itemsize for i in columns) + len(self._path_data) + len(self._tail_data)
+
+    @staticmethod
+    def _encode(value, values, ids):
+        try:
+            return ids[value]
+        except KeyError:
+            result = ids[value] = len(values)
+            values.append(value)
+            return result
+
+    def append(self, url):
+        """Append a url object or a url string."""
+        if not isinstance(url, URL):
+            url = self.url_class(url)
+
+        scheme, netloc, path, query, fragment = url.components
+
+        self._scheme_column.append(self._encode(scheme, self._schemes, self._scheme_ids))
+
+        netloc_id = self._encode(netloc, self._netlocs, self._netloc_ids)
+        if netloc_id == len(self._netloc_hosts):
+            self._netloc_hosts.append(self._encode(url.hostname or '', self._hosts, self._host_ids))
+        self._netloc_column.append(netloc_id)
+
+        path = path.encode('utf-8')
+        if len(self._prefix_lengths) % self.block_size:
+            prefix = len(os.path.commonprefix((self._last_path, path)))
+        else:
+            prefix = 0
+        self._prefix_lengths.append(prefix)
+        self._path_data += path[prefix:]
+        self._path_offsets.append(len(self._path_data))
+        self._last_path = path
+
+        tail = ('?' + query if query else '') + ('#' + fragment if fragment else '')
+        self._tail_data += tail.encode('utf-8')
+        self._tail_offsets.append(len(self._tail_data))
+
+    def extend(self, urls):
+        """Append url objects or url strings."""
+        for url in urls:
+            self.append(url)
+
+    def _path(self, idx):
+        path = b''
+        offsets = self._path_offsets
+        for i in range(idx - idx % self.block_size, idx + 1):
+            path = path[:self._prefix_lengths[i]] + self._path_data[offsets[i]:offsets[i + 1]]
+        return path
+
+    def _paths(self):
+        path = b''
+        offsets = self._path_offsets
+        for i, prefix in enumerate(self._prefix_lengths):
+            path = path[:prefix] + self._path_data[offsets[i]:offsets[i + 1]]
+            yield path
+
+    def _paths_at(self, indices):
+        """Iterate `(index, path)` of sorted `indices`, only the blocks that contain them are decoded."""
+        offsets, prefixes, data = self._path_offsets, self._prefix_lengths, self._path_data
+        block_size = self.block_size
+        path = b''
+        current = -1
+
+        for idx in indices:
+            if current < 0 or idx // block_size != current // block_size:
+                # first path of a block has no prefix
+                current = idx - idx % block_size - 1
+            while current < idx:
+                current += 1
+                path = path[:prefixes[current]] + data[offsets[current]:offsets[current + 1]]
+            yield idx, path
+
+    def _url_str(self, idx, path):
+        tail = self._tail_data[self._tail_offsets[idx]:self._tail_offsets[idx + 1]].decode('utf-8')
+        if tail[:1] == '?':
+            query, _, fragment = tail[1:].partition('#')
+        else:
+            query, fragment = '', tail[1:]
+
+        return urllib.parse.urlunsplit((self._schemes[self._scheme_column[idx]],
+                                        self._netlocs[self._netloc_column[idx]],
+                                        path.decode('utf-8'), query, fragment))
+
+    def get_str(self, idx):
+        """Return url string at `idx` without making url object."""
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError('URLStore index out of range')
+
+        return self._url_str(idx, self._path(idx))
+
+    def strings(self):
+        """Iterate url strings without making url objects."""
+        for i, path in enumerate(self._paths()):
+            yield self._url_str(i, path)
+
+    def select(self, host=None, path_prefix=None, has_query=None):
+        """Return indices of urls that match all of the conditions.
+
+        :param str host: (optional) hostname
+        :param str path_prefix: (optional) prefix of percent-encoded path
+        :param bool has_query: (optional) `True` for urls with query, `False` for urls without query
+        :return: indices
+        :rtype: array.array
+        """
+        # NOTE: Indices are kept in arrays (not in lists or sets of int objects) and each step filters them in order.
+        result = range(len(self))
+
+        if host is not None:
+            host_id = self._host_ids.get(host)
+            netloc_ids = frozenset(i for i, h in enumerate(self._netloc_hosts) if h == host_id)
+            column = self._netloc_column
+            result = array.array('Q', (i for i in result if column[i] in netloc_ids))
+
+        if has_query is not None:
+            offsets, data, question = self._tail_offsets, self._tail_data, ord('?')
+            result = array.array('Q', (i for i in result
+                                       if (offsets[i] < offsets[i + 1] and data[offsets[i]] == question) == has_query))
+
+        if path_prefix is not None:
+            path_prefix = path_prefix.encode('utf-8')
+            result = array.array('Q', (i for i, path in self._paths_at(result) if path.startswith(path_prefix)))
+
+        return result if isinstance(result, array.array) else array.array('Q', result)
+
+    def filter(self, host=None, path_prefix=None, has_query=None):
+        """Return a new store of urls that match all of the conditions, see `select`."""
+        result = self.__class__(url_class=self.url_class)
+        result.extend(self.get_str(i) for i in self.select(host=host, path_prefix=path_prefix, has_query=has_query))
+        return result
+
+    def group_by_host(self):
+        """Iterate `(hostname, indices)` pairs in order of first appearance of the host."""
+        groups = [array.array('Q') for _ in self._hosts]
+        netloc_hosts = self._netloc_hosts
+
+        for i, netloc_id in enumerate(self._netloc_column):
+            groups[netloc_hosts[netloc_id]].append(i)
+
+        for host, indices in zip(self._hosts, groups):
+            if indices:
+                yield host, indices
+
+
+def remove_dot_segments(path):
+    """Remove "." and ".." segments from path.
+
+    https://tools.ietf.org/html/rfc3986#section-5.2.4
+
+    :param str path: path string
+    :return: path string without dot segments
+    :rtype: str
+    """
+    segments = path.split('/')
+    result = []
+
+    for segment in segments:
+        if segment == '.':
+            continue
+
+        if segment == '..':
+            if len(result) > 1 or (result and result[0]):
+                del result[-1]
+            continue
+
+        result.append(segment)
+
+    if segments[-1] in ('.', '..'):
+        result.append('')
+
+    return '/'.join(result)
+
+
+def normalize_percent_encoding(text):
+    """Normalize percent-encoding, hexadecimal digits are uppercased and unreserved characters are decoded.
+
+    https://tools.ietf.org/html/rfc3986#section-6.2.2.1
+    https://tools.ietf.org/html/rfc3986#section-6.2.2.2
+
+    :param str text: percent-encoded string
+    :return: normalized string
+    :rtype: str
+    """
+    def replace(match):
+        char = chr(int(match.group(1), 16))
+        return char if char in _unreserved_chars else match.group(0).upper()
+
+    return _percent_re.sub(replace, text)
+
+
+_unreserved_chars = frozenset('ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-._~')
+_percent_re = re.compile('%([0-9A-Fa-f]{2})')
+
+
+def normalize(url):
+    """Syntax-based and scheme-based normalization of url.
+
+    https://tools.ietf.org/html/rfc3986#section-6.2.2
+    https://tools.ietf.org/html/rfc3986#section-6.2.3
+
+    Path segments are re-encoded from `URL.parts` by `segment_forms` (so percent-encoded sub-delims in path are
+    decoded as well), query and fragment are normalized by `normalize_percent_encoding`.
+
+    :param URL url: url object
+    :return: normalized url object
+    :rtype: URL
+    """
+    sep = url._flavour.sep
+    segments = url.parts[1:] if url._drv or url._root else url.parts
+    path = remove_dot_segments(url._root + sep.join(segment_forms(i)[0] for i in segments) + url.trailing_sep)
+
+    netloc = url.netloc
+    if url.port is not None and default_ports.get(url.scheme) == url.port:
+        netloc = netlocjoin(url.username, url.password, url.hostname, None)
+    if netloc and not path:
+        path = sep
+    drv = urllib.parse.urlunsplit((url.scheme, netloc, '', '', ''))
+
+    # NOTE: Path is already quoted, so parts are made directly like `URL.from_environ` instead of parsing a url
+    #       string. Last part is kept quoted and other parts are kept unquoted, same as `URL.path` expects.
+    body = path.lstrip(sep)
+    root = path[:len(path) - len(body)]
+    if body:
+        rel = body.rstrip(sep)
+        segments = [segment_forms(i)[1] for i in rel.split(sep)]
+        segments[-1] = rel.rpartition(sep)[2] + body[len(rel):]
+    else:
+        segments = ['']
+    if url.query:
+        segments[-1] += '?' + normalize_percent_encoding(url.query)
+    if url.fragment:
+        segments[-1] += '#' + normalize_percent_encoding(url.fragment)
+    parts = [i for i in segments if i and i != '.']
+
+    if drv or root:
+        parts.insert(0, drv + root)
+
+    return url._from_parsed_parts(drv, root, parts)
+
+
+@functools.lru_cache(maxsize=4096)
+def surt_host(hostname, port=None, scheme=''):
+    """Return host part of SURT key, labels are reversed and joined by comma.
+
+    :param str hostname: hostname string
+    :param int port: (optional) port number, omitted if it's the default port of `scheme`
+    :param str scheme: (optional) scheme string
+    :return: SURT host string like "com,example,www"
+    :rtype: str
+    """
+    hostname = hostname.lower().rstrip('.')
+
+    try:
+        address = ipaddress.ip_address(hostname)
+    except ValueError:
+        result = ','.join(reversed(idna_encode(hostname).split('.')))
+    else:
+        result = hostname if address.version == 4 else '[' + hostname + ']'
+
+    if port is not None and default_ports.get(scheme) != port:
+        result += ':' + str(port)
+
+    return result
+
+
+@functools.lru_cache(maxsize=4096)
+def host_key(hostname):
+    """Return stable 64-bit key of hostname, it's the same across processes unlike `hash`.
+
+    :param str hostname: hostname string
+    :return: 64-bit integer
+    :rtype: int
+    """
+    hostname = idna_encode(hostname.lower().rstrip('.')) if hostname else ''
+    return int.from_bytes(hashlib.md5(hostname.encode('ascii')).digest()[:8], 'big')
+
+
+def jump_hash(key, n):
+    """Jump consistent hash.
+
+    https://arxiv.org/abs/1406.2294
+
+    :param int key: 64-bit integer key
+    :param int n: number of buckets
+    :return: bucket number in `range(n)`
+    :rtype: int
+    """
+    if n < 1:
+        raise ValueError('number of buckets must be positive: {!r}'.format(n))
+
+    b, j = -1, 0
+    while j < n:
+        b = j
+        key = (key * 2862933555777941757 + 1) & 0xffffffffffffffff
+        j = int((b + 1) * ((1 << 31) / ((key >> 33) + 1)))
+
+    return b
+
+
+def _as_url(url):
+    return url if isinstance(url, URL) else URL(url)
+
+
+def sort_by_surt(urls):
+    """Return urls sorted by SURT key, urls of the same host are sorted next to each other.
+
+    :param urls: iterable of url objects or strings
+    :return: list of items of `urls`
+    :rtype: list
+    """
+    return sorted(urls, key=lambda url: _as_url(url).surt())
+
+
+def partition_by_shard(urls, n):
+    """Partition urls into `n` lists by `URL.shard`, order of urls in each list is kept.
+
+    :param urls: iterable of url objects or strings
+    :param int n: number of shards
+    :return: list of `n` lists of items of `urls`
+    :rtype: list
+    """
+    result = [[] for _ in range(n)]
+    shards = {}
+
+    for url in urls:
+        key = _as_url(url)._host_key
+        try:
+            shard = shards[key]
+        except KeyError:
+            shard = shards[key] = jump_hash(key, n)
+        result[shard].append(url)
+
+    return result
+
+
+def _parse_lines(lines, normalize_=False, unique=False, predicate=None):
+    # NOTE: This runs in worker processes, all arguments must be picklable.
+    result = []
+    seen = set()
+
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+
+        # the flavour reserves '\\x00' as an internal marker and asserts on it
+        if '\\x00' in line:
+            continue
+
+        try:
+            url = URL(line)
+
+            if normalize_:
+                url = normalize(url)
+
+            if predicate is not None and not predicate(url):
+                continue
+
+            line = str(url)
+
+        except ValueError:
+            # malformed netloc, port out of range, invalid idna, etc.
+            continue
+
+        if unique:
+            if line in seen:
+                continue
+            seen.add(line)
+
+        result.append(line)
+
+    return result
+
+
+def _read_chunks(filenames, chunk_size):
+    chunk = []
+
+    for filename in filenames:
+        if filename == '-':
+            fp = sys.stdin
+        else:
+            fp = open(filename, encoding='utf-8', errors='surrogateescape')
+
+        try:
+            for line in fp:
+                chunk.append(line)
+                if len(chunk) >= chunk_size:
+                    yield chunk
+                    chunk = []
+        finally:
+            if fp is not sys.stdin:
+                fp.close()
+
+    if chunk:
+        yield chunk
+
+
+def _has_scheme(schemes, url):
+    return url.scheme in schemes
+
+
+def parse_files(*filenames, normalize=False, unique=False, predicate=None, processes=None, chunk_size=10000):
+    """Parse urls in files (one url per line) with a process pool.
+
+    Lines are sharded into chunks of `chunk_size` and each chunk is parsed by `URL` in a worker process. Results are
+    yielded in input order as soon as they are available, at most `processes * 2` chunks are in flight.
+
+    :param str filenames: file names, '-' means stdin
+    :param bool normalize: normalize urls by `normalize`
+    :param bool unique: drop duplicated urls, all distinct urls are kept in a set so memory grows with the number of
+        distinct urls. For inputs that don't fit in memory, partition urls into files by `partition_by_shard` first
+        and parse each file separately, duplicates always go to the same shard.
+    :param predicate: (optional) picklable callable that takes `URL` and returns `False` to drop it
+    :param int processes: (optional) number of worker processes, default is `os.cpu_count()`
+    :param int chunk_size: number of lines sent to a worker at once
+    :return: iterator of url strings
+    """
+    processes = processes or os.cpu_count() or 1
+    worker = functools.partial(_parse_lines, normalize_=normalize, unique=unique, predicate=predicate)
+    seen = set()
+
+    with concurrent.futures.ProcessPoolExecutor(processes) as executor:
+        pending = collections.deque()
+
+        def drain():
+            for line in pending.popleft().result():
+                if unique:
+                    if line in seen:
+                        continue
+                    seen.add(line)
+                yield line
+
+        for chunk in _read_chunks(filenames or ('-',), chunk_size):
+            pending.append(executor.submit(worker, chunk))
+            if len(pending) > processes * 2:
+                yield from drain()
+
+        while pending:
+            yield from drain()
+
+
+def main(argv=None):
+    """Entry point of `python -m urlpath`."""
+    parser = argparse.ArgumentParser(prog='python -m urlpath', description='Parse urls in files with a process pool.')
+    parser.add_argument('files', nargs='*', default=['-'], help="input files, one url per line ('-' means stdin)")
+    parser.add_argument('-n', '--normalize', action='store_true', help='normalize urls')
+    parser.add_argument('-u', '--unique', action='store_true',
+                        help='drop duplicated urls (memory grows with the number of distinct urls)')
+    parser.add_argument('-s', '--scheme', action='append', help='keep only urls with this scheme (repeatable)')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='number of worker processes')
+    parser.add_argument('--chunk-size', type=int, default=10000, help='number of lines sent to a worker at once')
+    parser.add_argument('-o', '--output', default='-', help="output file ('-' means stdout)")
+    args = parser.parse_args(argv)
+
+    predicate = functools.partial(_has_scheme, frozenset(args.scheme)) if args.scheme else None
+
+    if args.output == '-':
+        output = sys.stdout
+    else:
+        output = open(args.output, 'w', encoding='utf-8', errors='surrogateescape')
+
+    try:
+        for line in parse_files(*args.files, normalize=args.normalize, unique=args.unique, predicate=predicate,
+                                processes=args.jobs, chunk_size=args.chunk_size):
+            output.write(line + '\n')
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())